@@ -1,7 +1,9 @@
 import os
 from dotenv import load_dotenv
 from fastapi import FastAPI, Depends, HTTPException, status, Request
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
@@ -9,8 +11,12 @@ from typing import Optional, List
 from datetime import datetime, timedelta
 import secrets
 import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
 from functools import wraps
 from slowapi import Limiter
+from slowapi.middleware import SlowAPIMiddleware
 from slowapi.util import get_remote_address
 from pyotp import TOTP
 from markupsafe import escape
@@ -25,6 +31,190 @@ logger = logging.getLogger(__name__)
 # Rate limiting
 limiter = Limiter(key_func=get_remote_address)
 
+# Metrics
+# Histogram bucket upper bounds in nanoseconds (0.5ms .. 10s); +Inf is implicit
+LATENCY_BUCKETS_NS = (
+    500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000,
+    50_000_000, 100_000_000, 250_000_000, 500_000_000, 1_000_000_000,
+    2_500_000_000, 5_000_000_000, 10_000_000_000,
+)
+# /metrics is only served when a scrape token is configured
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Record detailed spans for 1 in N requests (0 disables sampling)
+SPAN_SAMPLE_EVERY = max(int(os.getenv("METRICS_SPAN_SAMPLE_EVERY", "0")), 0)
+# Counter name -> (help text, label name, label values seeded with 0)
+COUNTERS = {
+    "gateway_auth_rejections_total": (
+        "Requests rejected by authentication or authorization", "status", ("401", "403"),
+    ),
+    "gateway_rate_limited_total": (
+        "Requests rejected by the rate limiter", "status", ("429",),
+    ),
+    "gateway_jwt_decode_total": (
+        "JWT access token decode attempts", "outcome", ("valid", "invalid"),
+    ),
+    "gateway_server_errors_total": (
+        "Requests that failed with a 5xx status or an unhandled exception", "status", ("500",),
+    ),
+}
+
+class Histogram:
+    # Preallocated bucket list; updates are plain list/int writes on the
+    # event loop thread, so no lock is taken on the request path
+    __slots__ = ("counts", "total_ns", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_NS) + 1)
+        self.total_ns = 0
+        self.count = 0
+
+    def observe(self, value_ns: int):
+        self.counts[bisect_left(LATENCY_BUCKETS_NS, value_ns)] += 1
+        self.total_ns += value_ns
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self.route_latency = {}
+        self.bcrypt_verify = Histogram()
+        self.counters = {
+            (name, label): 0
+            for name, (_, _, labels) in COUNTERS.items()
+            for label in labels
+        }
+        self.requests_seen = 0
+
+    def observe_route(self, method: str, route: str, value_ns: int):
+        key = (method, route)
+        histogram = self.route_latency.get(key)
+        if histogram is None:
+            histogram = self.route_latency[key] = Histogram()
+        histogram.observe(value_ns)
+
+    def inc(self, name: str, label: str):
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def should_sample(self) -> bool:
+        self.requests_seen += 1
+        return self.requests_seen % SPAN_SAMPLE_EVERY == 0
+
+    def render(self) -> str:
+        lines = [
+            "# HELP gateway_request_duration_seconds Request latency per route",
+            "# TYPE gateway_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.route_latency.items()):
+            labels = f'method="{method}",route="{route}"'
+            lines.extend(_render_histogram("gateway_request_duration_seconds", labels, histogram))
+        lines.extend([
+            "# HELP gateway_bcrypt_verify_seconds Time spent in bcrypt password verification",
+            "# TYPE gateway_bcrypt_verify_seconds histogram",
+        ])
+        lines.extend(_render_histogram("gateway_bcrypt_verify_seconds", "", self.bcrypt_verify))
+        for name, (help_text, label_name, _) in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, label), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f'{name}{{{label_name}="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+def _render_histogram(name: str, labels: str, histogram: Histogram):
+    prefix = labels + "," if labels else ""
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS_NS, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{prefix}le="{bound / 1e9:g}"}} {cumulative}'
+    yield f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}'
+    suffix = "{" + labels + "}" if labels else ""
+    yield f"{name}_sum{suffix} {histogram.total_ns / 1e9:.9f}"
+    yield f"{name}_count{suffix} {histogram.count}"
+
+metrics = Metrics()
+
+# Sub-step timings for the current request; only set on sampled requests.
+# Call sites check it directly so unsampled requests pay one ContextVar.get
+_current_spans: ContextVar[Optional[dict]] = ContextVar("current_spans", default=None)
+
+def record_span(spans: dict, name: str, value_ns: int):
+    spans[name] = spans.get(name, 0) + value_ns
+
+class TimedRoute(APIRoute):
+    # Handler time covers dependency resolution (JWT decode included),
+    # the endpoint itself and response serialization
+    def get_route_handler(self):
+        route_handler = super().get_route_handler()
+
+        async def timed_route_handler(request: Request):
+            spans = _current_spans.get()
+            if spans is None:
+                return await route_handler(request)
+            start_ns = time.perf_counter_ns()
+            try:
+                return await route_handler(request)
+            finally:
+                record_span(spans, "handler", time.perf_counter_ns() - start_ns)
+
+        return timed_route_handler
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: BaseHTTPMiddleware (@app.middleware) runs every
+    # request through an extra task group and costs far more than the
+    # instrumentation itself
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        spans = spans_token = None
+        if SPAN_SAMPLE_EVERY and metrics.should_sample():
+            spans = {}
+            spans_token = _current_spans.set(spans)
+        # Latency is measured to the start of the response, as X-Process-Time
+        # always was. Unhandled exceptions propagate as 500s; record them
+        # before re-raising
+        status_code = 500
+        elapsed_ns = None
+        start_ns = time.perf_counter_ns()
+
+        async def send_with_process_time(message):
+            nonlocal status_code, elapsed_ns
+            if message["type"] == "http.response.start":
+                elapsed_ns = time.perf_counter_ns() - start_ns
+                status_code = message["status"]
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"x-process-time", b"%d.%09d" % divmod(elapsed_ns, 1_000_000_000)),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_process_time)
+        finally:
+            if elapsed_ns is None:
+                elapsed_ns = time.perf_counter_ns() - start_ns
+            if spans_token is not None:
+                _current_spans.reset(spans_token)
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            metrics.observe_route(scope["method"], route_path, elapsed_ns)
+            if status_code >= 400:
+                # Failed scrapes are a scraper misconfiguration, not a user auth failure
+                if status_code in (401, 403) and route_path != "/metrics":
+                    metrics.inc("gateway_auth_rejections_total", str(status_code))
+                elif status_code == 429:
+                    metrics.inc("gateway_rate_limited_total", "429")
+                elif status_code >= 500:
+                    metrics.inc("gateway_server_errors_total", str(status_code))
+            if spans is not None:
+                steps = " ".join(f"{name}_us={value // 1000}" for name, value in spans.items())
+                logger.info(
+                    f"span {scope['method']} {route_path} status={status_code} "
+                    f"total_us={elapsed_ns // 1000} {steps}".rstrip()
+                )
+
 # Fake database
 fake_users_db = {
     "john": {
@@ -74,10 +264,20 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 app = FastAPI()
+if SPAN_SAMPLE_EVERY:
+    app.router.route_class = TimedRoute
 
 # Utility functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    start_ns = time.perf_counter_ns()
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    finally:
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        metrics.bcrypt_verify.observe(elapsed_ns)
+        spans = _current_spans.get()
+        if spans is not None:
+            record_span(spans, "bcrypt_verify", elapsed_ns)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
@@ -125,14 +325,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    spans = _current_spans.get()
+    start_ns = time.perf_counter_ns() if spans is not None else 0
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
     except JWTError:
+        metrics.inc("gateway_jwt_decode_total", "invalid")
         raise credentials_exception
+    finally:
+        if spans is not None:
+            record_span(spans, "jwt_decode", time.perf_counter_ns() - start_ns)
+    metrics.inc("gateway_jwt_decode_total", "valid")
+    username: str = payload.get("sub")
+    if username is None:
+        raise credentials_exception
+    token_data = TokenData(username=username)
     user = get_user(fake_users_db, username=token_data.username)
     if user is None:
         raise credentials_exception
@@ -168,13 +375,31 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 async def admin_dashboard(current_user: User = Depends(get_current_active_user)):
     return {"message": "Welcome to the admin dashboard"}
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    return response
+async def metrics_endpoint(request: Request):
+    # Route list, auth failure rates and bcrypt timing are sensitive, so
+    # scrapers must present the configured bearer token. Compare bytes:
+    # compare_digest rejects non-ASCII str, and headers arrive as latin-1
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(
+        token.encode(), METRICS_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+if METRICS_TOKEN:
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
+# Add rate limiting to all routes (registered before the timing middleware
+# so that rejected requests are still timed)
+app.state.limiter = limiter
+app.add_middleware(SlowAPIMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -184,10 +409,6 @@ async def http_exception_handler(request, exc):
         content={"detail": exc.detail},
     )
 
-# Add rate limiting to all routes
-app.state.limiter = limiter
-app.add_middleware(SlowAPIMiddleware)
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file